@@ -0,0 +1,390 @@
+"""Unit-тесты загрузчика курса USD/RUB.
+
+HTTP мокается на уровне транспорта через respx: запросы проходят через
+настоящий ``httpx.AsyncClient``, поэтому логика ретраев, обработки 5xx
+и разбора ответов проверяется по-настоящему, а не подменяется.
+"""
+
+import asyncio
+import datetime as dt
+
+import httpx
+import pandas as pd
+import pytest
+import respx
+
+import cbr_usdrub_fetcher as fetcher
+
+MONTH_INDEX_RE = r"https://www\.cbr-xml-daily\.ru/archive/\d{4}/\d{2}/$"
+
+
+@pytest.fixture(autouse=True)
+def reset_breaker():
+    """Сбрасывает общий circuit breaker, чтобы тесты не влияли друг на друга."""
+    fetcher._breaker.reset()
+    yield
+    fetcher._breaker.reset()
+
+
+def archive_url(d: dt.date) -> str:
+    return fetcher._url_for(d)
+
+
+def daily_payload(rate: float) -> dict:
+    return {"Valute": {"USD": {"Value": rate}}}
+
+
+def run_fetch_rates(dates, cache_path=None):
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_rates(dates, client, cache_path)
+
+    return asyncio.run(go())
+
+
+def make_record(**overrides):
+    defaults = dict(
+        date="2025-12-20",
+        pair=fetcher.PAIR,
+        rate=90.0,
+        source=fetcher.SOURCE,
+        retrieved_at="2025-12-20T12:00:00",
+    )
+    defaults.update(overrides)
+    return fetcher.RateRecord(**defaults)
+
+
+def test_build_date_range_returns_seven_days_ascending():
+    today = dt.date(2025, 12, 20)
+    result = fetcher.build_date_range(today)
+    assert len(result) == fetcher.DAYS
+    assert result[-1] == today
+    assert result[0] == today - dt.timedelta(days=6)
+    assert result == sorted(result)
+
+
+def test_build_date_range_is_cached():
+    fetcher._build_date_range_cached.cache_clear()
+    today = dt.date(2025, 12, 20)
+    first = fetcher.build_date_range(today)
+    second = fetcher.build_date_range(today)
+    assert first == second
+    info = fetcher._build_date_range_cached.cache_info()
+    assert info.hits == 1
+    assert info.misses == 1
+
+
+def test_url_for_pads_month_and_day():
+    url = fetcher._url_for(dt.date(2025, 1, 5))
+    assert url == "https://www.cbr-xml-daily.ru/archive/2025/01/05/daily_json.js"
+
+
+def test_validate_rate_accepts_positive_number():
+    assert fetcher.validate_rate(90.5) == 90.5
+    assert fetcher.validate_rate(1) == 1.0
+
+
+@pytest.mark.parametrize("bad", [0, -1.5, float("nan"), float("inf"), "90", None, True])
+def test_validate_rate_rejects_bad_values(bad):
+    with pytest.raises(fetcher.FetchError):
+        fetcher.validate_rate(bad)
+
+
+def test_validate_rates_accepts_good_arrays():
+    fetcher.validate_rates([])
+    fetcher.validate_rates([90.0, 91.5, 1.0])
+
+
+@pytest.mark.parametrize("bad", [[90.0, -1.0], [float("nan")], [0.0], [float("inf")]])
+def test_validate_rates_rejects_bad_arrays(bad):
+    with pytest.raises(fetcher.FetchError):
+        fetcher.validate_rates(bad)
+
+
+@respx.mock
+def test_fetch_rates_rejects_bad_cached_rate(tmp_path):
+    dates = fetcher.build_date_range(dt.date(2025, 12, 20))
+    cache_path = tmp_path / "rates.json"
+    for d in dates:
+        fetcher._cache_store(cache_path, d, 90.0)
+    fetcher._cache_store(cache_path, dates[3], -5.0)
+
+    # Все даты в кэше — сетевых вызовов нет, но мусор из кэша ловится.
+    with pytest.raises(fetcher.FetchError):
+        run_fetch_rates(dates, cache_path)
+
+
+@respx.mock
+def test_fetch_rates_collects_records():
+    dates = fetcher.build_date_range(dt.date(2025, 12, 20))
+    weekend = dt.date(2025, 12, 14)
+    respx.get(url__regex=MONTH_INDEX_RE).respond(404)
+    for d in dates:
+        if d == weekend:
+            respx.get(archive_url(d)).respond(404)
+        else:
+            respx.get(archive_url(d)).respond(200, json=daily_payload(90.0 + d.day))
+
+    records = run_fetch_rates(dates)
+
+    assert len(records) == 6
+    assert all(r.pair == fetcher.PAIR for r in records)
+    assert all(r.source == fetcher.SOURCE for r in records)
+    assert [r.date for r in records] == [
+        d.isoformat() for d in dates if d != weekend
+    ]
+
+
+@respx.mock
+def test_fetch_rates_derives_everything_from_now():
+    dates = fetcher.build_date_range(dt.date(2025, 12, 20))
+    now = dt.datetime(2025, 12, 20, 23, 59, 59, tzinfo=dt.timezone.utc)
+    respx.get(url__regex=MONTH_INDEX_RE).respond(404)
+    respx.get("https://www.cbr-xml-daily.ru/daily_json.js").respond(404)
+    for d in dates:
+        respx.get(archive_url(d)).respond(200, json=daily_payload(90.0))
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_rates(dates, client, cache_path=None, now=now)
+
+    records = asyncio.run(go())
+    assert all(r.retrieved_at == "2025-12-20T23:59:59+00:00" for r in records)
+
+
+@respx.mock
+def test_fetch_rates_propagates_errors():
+    dates = fetcher.build_date_range(dt.date(2025, 12, 20))
+    respx.get(url__regex=MONTH_INDEX_RE).respond(404)
+    for d in dates:
+        respx.get(archive_url(d)).respond(400)
+
+    with pytest.raises(fetcher.FetchError):
+        run_fetch_rates(dates)
+
+
+@respx.mock
+def test_fetch_with_retries_retries_on_5xx():
+    d = dt.date(2025, 12, 18)
+    route = respx.get(archive_url(d)).mock(
+        side_effect=[
+            httpx.Response(500),
+            httpx.Response(200, json=daily_payload(91.0)),
+        ]
+    )
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_with_retries(
+                lambda: fetcher.fetch_daily_rate(d, client), base=0.0, cap=0.0
+            )
+
+    assert asyncio.run(go()) == 91.0
+    assert route.call_count == 2
+
+
+@respx.mock
+def test_fetch_with_retries_gives_up_on_4xx():
+    d = dt.date(2025, 12, 18)
+    route = respx.get(archive_url(d)).respond(400)
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_with_retries(
+                lambda: fetcher.fetch_daily_rate(d, client), base=0.0, cap=0.0
+            )
+
+    with pytest.raises(fetcher.FetchError):
+        asyncio.run(go())
+    assert route.call_count == 1
+
+
+@respx.mock
+def test_fetch_rates_prefers_bulk_results():
+    dates = fetcher.build_date_range(dt.date(2025, 12, 20))
+    days = {d.isoformat(): daily_payload(90.0 + d.day) for d in dates}
+    respx.get("https://www.cbr-xml-daily.ru/archive/2025/12/").respond(
+        200, json={"days": days}
+    )
+    # Поштучные archive-URL не замоканы: обращение к ним уронит тест.
+
+    records = run_fetch_rates(dates)
+    assert [r.rate for r in records] == [90.0 + d.day for d in dates]
+
+
+@respx.mock
+def test_fetch_rate_range_parses_month_index():
+    start, end = dt.date(2025, 12, 15), dt.date(2025, 12, 17)
+    respx.get("https://www.cbr-xml-daily.ru/archive/2025/12/").respond(
+        200,
+        json={
+            "days": {
+                "2025-12-15": daily_payload(90.0),
+                "2025-12-16": daily_payload(91.0),
+                "2025-12-31": daily_payload(99.0),  # вне диапазона
+            }
+        },
+    )
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_rate_range(start, end, client)
+
+    rates = asyncio.run(go())
+    assert rates == {dt.date(2025, 12, 15): 90.0, dt.date(2025, 12, 16): 91.0}
+
+
+@respx.mock
+def test_fetch_daily_rate_rejects_oversize_response():
+    d = dt.date(2025, 12, 18)
+    big = b'{"padding": "' + b"x" * fetcher.MAX_RESPONSE_BYTES + b'"}'
+    respx.get(archive_url(d)).respond(200, content=big)
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_daily_rate(d, client)
+
+    with pytest.raises(fetcher.FetchError, match="слишком большой"):
+        asyncio.run(go())
+
+
+@respx.mock
+def test_fetch_daily_rate_rejects_invalid_json():
+    d = dt.date(2025, 12, 18)
+    respx.get(archive_url(d)).respond(200, content=b"<html>not json</html>")
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_daily_rate(d, client)
+
+    with pytest.raises(fetcher.FetchError, match="JSON"):
+        asyncio.run(go())
+
+
+def test_iter_months_spans_year_boundary():
+    months = list(fetcher._iter_months(dt.date(2025, 11, 28), dt.date(2026, 1, 3)))
+    assert months == [(2025, 11), (2025, 12), (2026, 1)]
+
+
+@respx.mock
+def test_fetch_rates_uses_cache_for_past_dates(tmp_path):
+    dates = fetcher.build_date_range(dt.date(2025, 12, 20))
+    cache_path = tmp_path / "rates.json"
+    respx.get(url__regex=MONTH_INDEX_RE).respond(404)
+    routes = [
+        respx.get(archive_url(d)).respond(200, json=daily_payload(90.0)) for d in dates
+    ]
+
+    # Первый запуск: всё из сети, прошлые даты попадают в кэш.
+    records = run_fetch_rates(dates, cache_path)
+    assert len(records) == 7
+    assert sum(r.call_count for r in routes) == 7
+    cache = fetcher._cache_load(cache_path)
+    assert len(cache) == 7  # все даты в прошлом относительно date.today()
+
+    # Второй запуск: прошлые даты берутся из кэша без сетевых вызовов.
+    records = run_fetch_rates(dates, cache_path)
+    assert len(records) == 7
+    assert sum(r.call_count for r in routes) == 7
+
+
+def test_cache_store_and_load_roundtrip(tmp_path):
+    path = tmp_path / "sub" / "rates.json"
+    fetcher._cache_store(path, dt.date(2025, 12, 19), 89.5)
+    fetcher._cache_store(path, dt.date(2025, 12, 20), 90.0)
+    assert fetcher._cache_load(path) == {"2025-12-19": 89.5, "2025-12-20": 90.0}
+
+
+def test_cache_load_missing_or_broken_file(tmp_path):
+    assert fetcher._cache_load(tmp_path / "absent.json") == {}
+    broken = tmp_path / "broken.json"
+    broken.write_text("{oops", encoding="utf-8")
+    assert fetcher._cache_load(broken) == {}
+
+
+def test_circuit_breaker_opens_after_threshold_failures():
+    breaker = fetcher.CircuitBreaker(threshold=3, cooldown=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open()
+    breaker.record_failure()
+    assert breaker.is_open()
+
+
+def test_circuit_breaker_half_open_after_cooldown():
+    breaker = fetcher.CircuitBreaker(threshold=1, cooldown=0.0)
+    breaker.record_failure()
+    # cooldown уже истёк — пропускается один пробный запрос.
+    assert not breaker.is_open()
+    breaker.reset()
+    assert not breaker.is_open()
+    assert breaker.failure_count == 0
+
+
+@respx.mock
+def test_fetch_daily_rate_short_circuits_when_breaker_open():
+    # Ни одного маршрута не замокано: сетевой вызов уронил бы тест.
+    breaker = fetcher.CircuitBreaker(threshold=1, cooldown=60.0)
+    breaker.record_failure()
+
+    async def go():
+        async with httpx.AsyncClient() as client:
+            return await fetcher.fetch_daily_rate(dt.date(2025, 12, 20), client, breaker)
+
+    assert asyncio.run(go()) is None
+
+
+def test_retry_delay_bounded_by_cap():
+    for attempt in range(10):
+        delay = fetcher._retry_delay(attempt, base=0.2, cap=1.5, retry_after=None)
+        assert 0 <= delay <= 1.5
+
+
+def test_retry_delay_honors_retry_after_header():
+    assert fetcher._retry_delay(0, base=0.2, cap=30.0, retry_after="5") == 5.0
+    # Невалидный заголовок игнорируется, работает обычный джиттер.
+    assert fetcher._retry_delay(0, base=0.2, cap=30.0, retry_after="soon") <= 0.2
+
+
+def test_make_client_configuration():
+    client = fetcher._make_client()
+    try:
+        assert client.headers["User-Agent"] == "cbr-usdrub-fetcher/1.0"
+        assert client.headers["Accept-Encoding"] == "gzip"
+    finally:
+        asyncio.run(client.aclose())
+
+
+def test_save_parquet_roundtrip(tmp_path):
+    records = [make_record(), make_record(date="2025-11-30", rate=89.5)]
+    out_dir = tmp_path / "dataset"
+    fetcher.save_parquet(records, str(out_dir))
+
+    # Hive-партиционирование по году/месяцу.
+    assert (out_dir / "year=2025" / "month=12" / "cbr-0.parquet").exists()
+    assert (out_dir / "year=2025" / "month=11" / "cbr-0.parquet").exists()
+
+    df = pd.read_parquet(out_dir).sort_values("date").reset_index(drop=True)
+    assert len(df) == 2
+    assert df.iloc[1]["date"] == dt.date(2025, 12, 20)
+    assert df.iloc[1]["rate"] == 90.0
+    assert df.iloc[1]["pair"] == fetcher.PAIR
+    assert {"date", "pair", "rate", "source", "retrieved_at"} <= set(df.columns)
+
+
+def test_save_parquet_overwrites_same_partition(tmp_path):
+    out_dir = tmp_path / "dataset"
+    fetcher.save_parquet([make_record(rate=90.0)], str(out_dir))
+    fetcher.save_parquet([make_record(rate=91.0)], str(out_dir))
+
+    df = pd.read_parquet(out_dir)
+    # Повторный запуск перезаписывает файл партиции, а не добавляет новый.
+    assert len(df) == 1
+    assert df.iloc[0]["rate"] == 91.0
+
+
+def test_save_parquet_with_alternate_compression(monkeypatch, tmp_path):
+    monkeypatch.setattr(fetcher, "PARQUET_COMPRESSION", "snappy")
+    out_dir = tmp_path / "dataset_snappy"
+    fetcher.save_parquet([make_record()], str(out_dir))
+    assert pd.read_parquet(out_dir).iloc[0]["rate"] == 90.0